@@ -1,8 +1,46 @@
+import concurrent.futures
 import io
+import time
 import numpy as np
 import pandas as pd
 import streamlit as st
-from typing import List
+import xlsxwriter
+from typing import Callable, List
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+RATIO_SAMPLE_ROWS = 1000
+EXCEL_CHUNK_ROWS = 50_000
+EXCEL_MAX_ROWS = 1_048_576
+
+# Header keywords that mark a column as not being a balance
+EXCLUDE_PATTERN = "|".join(["member", "route", "name", "date", "month", "year", "id", "clerk", "zone"])
+
+# Classification codes: 0 zero, 1 increasing, 2 decreasing, 3 constant, 4 mixed.
+# Reasons map one-to-one onto codes; eligibility collapses them onto three categories.
+ELIGIBILITY_CATEGORIES = ["Eligible", "Ineligible", "Dormant"]
+ELIGIBILITY_CODES = np.array([0, 1, 0, 2, 1], dtype=np.int8)
+REASON_LABELS = np.array(["Zero balance across selected months",
+                          "Strictly increasing debt across selected months",
+                          "Strictly decreasing debt across selected months",
+                          "Constant balance across selected months (Dormant)",
+                          "Mixed behaviour"], dtype="<U49")
+
+# Same precedence as the Numba kernel, fused into one numexpr pass
+CLASSIFY_EXPRESSION = (
+    "where((a == 0) & (b == 0) & (c == 0), 0, "
+    "where((a < b) & (b < c), 1, "
+    "where((a > b) & (b > c), 2, "
+    "where((a == b) & (b == c), 3, 4))))"
+)
 
 st.set_page_config(page_title="Debt Eligibility App", layout="wide")
 st.title("Debt Eligibility Checker")
@@ -12,55 +50,162 @@ st.info(
     "Click **Run eligibility** to generate results + download."
 )
 
-def compute_debt_eligibility(df: pd.DataFrame, col_m1: str, col_m2: str, col_m3: str) -> pd.DataFrame:
-    df = df.copy()
+if njit is not None:
+    # Serial on purpose: Streamlit calls this from one thread per session, and Numba's parallel
+    # threading layers are not safe to enter concurrently
+    @njit(cache=True)
+    def classify_balances(m1, m2, m3, out):
+        # Single pass, no temporary masks: 0 zero, 1 increasing, 2 decreasing, 3 constant, 4 mixed
+        for i in range(m1.shape[0]):
+            a, b, c = m1[i], m2[i], m3[i]
+            if a == 0 and b == 0 and c == 0:
+                out[i] = 0
+            elif a < b and b < c:
+                out[i] = 1
+            elif a > b and b > c:
+                out[i] = 2
+            elif a == b and b == c:
+                out[i] = 3
+            else:
+                out[i] = 4
+elif ne is not None:
+    def classify_balances(m1, m2, m3, out):
+        out[:] = ne.evaluate(CLASSIFY_EXPRESSION, local_dict={"a": m1, "b": m2, "c": m3})
+else:
+    def classify_balances(m1, m2, m3, out):
+        zero_all = (m1 == 0) & (m2 == 0) & (m3 == 0)
+        strictly_increasing = (m1 < m2) & (m2 < m3)
+        strictly_decreasing = (m1 > m2) & (m2 > m3)
+        constant = (m1 == m2) & (m2 == m3)
+
+        # Assigned in reverse precedence so earlier conditions win
+        out[:] = 4
+        out[constant] = 3
+        out[strictly_decreasing] = 2
+        out[strictly_increasing] = 1
+        out[zero_all] = 0
 
+def compute_debt_eligibility(df: pd.DataFrame, col_m1: str, col_m2: str, col_m3: str) -> pd.DataFrame:
+    # Only the two label columns are built; callers join them onto the columns they need
     def to_num(s: pd.Series) -> pd.Series:
         return pd.to_numeric(s, errors="coerce").fillna(0)
 
-    m1 = to_num(df[col_m1])
-    m2 = to_num(df[col_m2])
-    m3 = to_num(df[col_m3])
+    balances = df[[col_m1, col_m2, col_m3]]
 
-    zero_all = (m1 == 0) & (m2 == 0) & (m3 == 0)
-    strictly_increasing = (m1 < m2) & (m2 < m3)
-    strictly_decreasing = (m1 > m2) & (m2 > m3)
-    constant = (m1 == m2) & (m2 == m3)
+    # Already-numeric columns with no gaps need no coercion or fill, so hand them to the kernel as is
+    if all(dt.kind in "iuf" for dt in balances.dtypes) and not balances.isna().to_numpy().any():
+        m1, m2, m3 = (balances[c].to_numpy() for c in (col_m1, col_m2, col_m3))
+    else:
+        m1 = to_num(df[col_m1]).to_numpy()
+        m2 = to_num(df[col_m2]).to_numpy()
+        m3 = to_num(df[col_m3]).to_numpy()
 
-    df["DebtEligibility"] = np.select(
-        [zero_all, strictly_increasing, strictly_decreasing, constant],
-        ["Eligible", "Ineligible", "Eligible", "Dormant"],
-        default="Ineligible"
-    )
+    codes = np.empty(len(m1), dtype=np.int8)
+    classify_balances(m1, m2, m3, codes)
 
-    df["Reason"] = np.select(
-        [zero_all, strictly_increasing, strictly_decreasing, constant],
-        ["Zero balance across selected months",
-         "Strictly increasing debt across selected months",
-         "Strictly decreasing debt across selected months",
-         "Constant balance across selected months (Dormant)"],
-        default="Mixed behaviour"
-    )
+    eligibility = pd.Categorical.from_codes(ELIGIBILITY_CODES[codes], categories=ELIGIBILITY_CATEGORIES)
+    reason = pd.Categorical.from_codes(codes, categories=REASON_LABELS)
 
-    return df
+    return pd.DataFrame({"DebtEligibility": eligibility, "Reason": reason}, index=df.index)
+
+def lowered_names(columns: pd.Index) -> pd.Index:
+    # Arrow strings let the keyword checks run as vectorized string kernels
+    return pd.Index(columns).astype("string[pyarrow]").str.lower()
 
+@st.cache_data(show_spinner=False)
 def guess_balance_columns(df: pd.DataFrame) -> List[str]:
-    exclude_keywords = ["member", "route", "name", "date", "month", "year", "id", "clerk", "zone"]
-    candidates = []
+    keep = df.columns[~lowered_names(df.columns).str.contains(EXCLUDE_PATTERN)]
 
-    for c in df.columns:
-        c_low = str(c).lower()
-        if any(k in c_low for k in exclude_keywords):
-            continue
+    # The leading rows are enough to tell numeric columns from text ones
+    sample = df[keep].head(RATIO_SAMPLE_ROWS)
+    non_null_ratio = sample.notna().mean(axis=0).to_numpy(copy=True)
 
-        series = pd.to_numeric(df[c], errors="coerce")
-        non_null_ratio = float(series.notna().mean())
+    # Columns that are already numeric need no parsing, only the others go through to_numeric
+    needs_parse = ~sample.dtypes.map(lambda dt: dt.kind in "iufb").to_numpy(dtype=bool)
+    if needs_parse.any():
+        converted = sample.iloc[:, needs_parse].apply(pd.to_numeric, errors="coerce")
+        non_null_ratio[needs_parse] = converted.notna().mean(axis=0).to_numpy()
 
-        if non_null_ratio > 0.3:
-            candidates.append(c)
+    candidates = [c for c, ratio in zip(keep, non_null_ratio) if ratio > 0.3]
 
     return candidates if candidates else list(df.columns)
 
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_data(file_bytes: bytes, name: str) -> pd.DataFrame:
+    # Keyed on the file contents so widget reruns reuse the parsed frame
+    if name.lower().endswith(".csv"):
+        df = None
+        try:
+            df = pd.read_csv(io.BytesIO(file_bytes), engine="pyarrow")
+        except pd.errors.ParserError:
+            pass
+        # Short rows (filled with NaN), repeated headers ("Bal", "Bal.1") and non-UTF-8 text, which
+        # pyarrow keeps as raw bytes, all go through the default parser instead
+        if df is None or df.columns.has_duplicates or any(
+            dt == object and pd.api.types.infer_dtype(df.iloc[:, i], skipna=True) == "bytes"
+            for i, dt in enumerate(df.dtypes)
+        ):
+            df = pd.read_csv(io.BytesIO(file_bytes))
+    else:
+        try:
+            df = pd.read_excel(io.BytesIO(file_bytes), engine="calamine")
+        except Exception:
+            # Older pandas or a workbook calamine can't handle: use the default reader
+            df = pd.read_excel(io.BytesIO(file_bytes))
+
+    # Text-only object columns move to Arrow strings; mixed columns keep their numbers as numbers
+    # Walked by position so repeated header labels can't pull in a whole sub-frame
+    for i, dt in enumerate(df.dtypes):
+        if dt == object and pd.api.types.infer_dtype(df.iloc[:, i], skipna=True) == "string":
+            df.isetitem(i, df.iloc[:, i].astype("string[pyarrow]"))
+    return df
+
+def write_excel(results: pd.DataFrame, summary: pd.DataFrame, on_progress: Callable[[float], None]) -> io.BytesIO:
+    # Runs on a worker thread, so it reports progress through the callback instead of calling st.*
+    total_rows = max(1, len(results) + len(summary))
+    written = 0
+
+    def write_sheet(workbook, name: str, frame: pd.DataFrame) -> None:
+        nonlocal written
+        if len(frame) + 1 > EXCEL_MAX_ROWS:
+            raise ValueError(f"{name} has {len(frame)} rows, more than an Excel sheet can hold.")
+
+        worksheet = workbook.add_worksheet(name)
+        worksheet.write_row(0, 0, [str(c) for c in frame.columns], header_format)
+
+        # constant_memory flushes each row once the next one starts, so rows go out strictly in order
+        for start in range(0, len(frame), EXCEL_CHUNK_ROWS):
+            chunk = frame.iloc[start:start + EXCEL_CHUNK_ROWS]
+            # xlsxwriter rejects NaN, inf and pd.NA: missing values become blank cells and infinities
+            # "inf"/"-inf" text, as pandas wrote them. Done on a NumPy object array so pandas can't
+            # infer the column back to float.
+            values = chunk.to_numpy(dtype=object, copy=True)
+            values[chunk.isna().to_numpy()] = None
+            for i, dt in enumerate(chunk.dtypes):
+                if dt.kind == "f":
+                    col = chunk.iloc[:, i].to_numpy(dtype=float, na_value=np.nan)
+                    values[np.isposinf(col), i] = "inf"
+                    values[np.isneginf(col), i] = "-inf"
+
+            for row_num, row in enumerate(values.tolist(), start=start + 1):
+                worksheet.write_row(row_num, 0, row)
+
+            written += len(chunk)
+            on_progress(0.95 * written / total_rows)
+
+    towrite = io.BytesIO()
+    workbook = xlsxwriter.Workbook(towrite, {"constant_memory": True, "default_date_format": "yyyy-mm-dd hh:mm:ss"})
+    # Same header look as pandas' to_excel
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+
+    write_sheet(workbook, "Results", results)
+    write_sheet(workbook, "Summary", summary)
+    workbook.close()
+
+    towrite.seek(0)
+    on_progress(1.0)
+    return towrite
+
 uploaded = st.file_uploader("Upload file", type=["xlsx", "xls", "csv"])
 
 if not uploaded:
@@ -69,10 +214,7 @@ if not uploaded:
 
 # Read file
 with st.spinner("Reading your file..."):
-    if uploaded.name.lower().endswith(".csv"):
-        df = pd.read_csv(uploaded)
-    else:
-        df = pd.read_excel(uploaded)
+    df = load_data(uploaded.getvalue(), uploaded.name)
 
 st.subheader("Data Preview")
 st.dataframe(df.head(20), width="stretch")
@@ -82,44 +224,18 @@ st.subheader("Map your columns")
 
 all_cols = list(df.columns)
 
-member_guess = next(
-    (c for c in all_cols if str(c).lower().replace(" ", "") in ["memberno", "member_no", "membernumber"]),
-    None
-)
-route_guess = next((c for c in all_cols if "route" in str(c).lower()), None)
+# Normalized header -> position of its first column, so the guesses below are dict lookups
+col_index = {}
+for i, key in enumerate(lowered_names(df.columns).str.replace(" ", "")):
+    col_index.setdefault(key, i)
 
-# Try to detect member name column (optional)
-member_name_guess = next(
-    (c for c in all_cols if str(c).lower().strip() in ["member", "member name", "membername", "name"]),
-    None
-)
+member_idx = min((col_index[k] for k in ["memberno", "member_no", "membernumber"] if k in col_index), default=None)
+route_idx = next((i for k, i in col_index.items() if "route" in k), None)
 
-col_member = st.selectbox(
-    "Select Member No column",
-    all_cols,
-    index=all_cols.index(member_guess) if member_guess in all_cols else 0
-)
-
-# Only show Member Name selector if we detected a likely one
-if member_name_guess:
-    col_member_name = st.selectbox(
-        "Select Member Name column (optional)",
-        ["(None)"] + all_cols,
-        index=(["(None)"] + all_cols).index(member_name_guess)
-    )
-    if col_member_name == "(None)":
-        col_member_name = None
-else:
-    col_member_name = None
-
-col_route = st.selectbox(
-    "Select Route column",
-    all_cols,
-    index=all_cols.index(route_guess) if route_guess in all_cols else (1 if len(all_cols) > 1 else 0)
-)
+# Try to detect member name column (optional)
+member_name_idx = min((col_index[k] for k in ["member", "membername", "name"] if k in col_index), default=None)
 
 balance_candidates = guess_balance_columns(df)
-st.caption("Select 3 balance columns in chronological order (e.g., Nov → Dec → Jan).")
 
 def idx_or_zero(cols, val):
     return cols.index(val) if val in cols else 0
@@ -128,27 +244,55 @@ default_m1 = balance_candidates[0] if len(balance_candidates) > 0 else all_cols[
 default_m2 = balance_candidates[1] if len(balance_candidates) > 1 else all_cols[min(1, len(all_cols) - 1)]
 default_m3 = balance_candidates[2] if len(balance_candidates) > 2 else all_cols[min(2, len(all_cols) - 1)]
 
-col_m1 = st.selectbox("Month 1 balance column", balance_candidates, index=idx_or_zero(balance_candidates, default_m1))
-col_m2 = st.selectbox("Month 2 balance column", balance_candidates, index=idx_or_zero(balance_candidates, default_m2))
-col_m3 = st.selectbox("Month 3 balance column", balance_candidates, index=idx_or_zero(balance_candidates, default_m3))
+# A form batches the selections into a single rerun on submit
+with st.form("column_map"):
+    col_member = st.selectbox(
+        "Select Member No column",
+        all_cols,
+        index=member_idx if member_idx is not None else 0
+    )
 
-if len({col_m1, col_m2, col_m3}) < 3:
-    st.warning("Please select 3 DIFFERENT balance columns.")
-    st.stop()
+    # Only show Member Name selector if we detected a likely one
+    if member_name_idx is not None:
+        col_member_name = st.selectbox(
+            "Select Member Name column (optional)",
+            ["(None)"] + all_cols,
+            index=member_name_idx + 1
+        )
+        if col_member_name == "(None)":
+            col_member_name = None
+    else:
+        col_member_name = None
+
+    col_route = st.selectbox(
+        "Select Route column",
+        all_cols,
+        index=route_idx if route_idx is not None else (1 if len(all_cols) > 1 else 0)
+    )
+
+    st.caption("Select 3 balance columns in chronological order (e.g., Nov → Dec → Jan).")
+
+    col_m1 = st.selectbox("Month 1 balance column", balance_candidates, index=idx_or_zero(balance_candidates, default_m1))
+    col_m2 = st.selectbox("Month 2 balance column", balance_candidates, index=idx_or_zero(balance_candidates, default_m2))
+    col_m3 = st.selectbox("Month 3 balance column", balance_candidates, index=idx_or_zero(balance_candidates, default_m3))
+
+    submitted = st.form_submit_button("Run eligibility")
 
 # Run
-if st.button("Run eligibility"):
-    with st.spinner("Computing eligibility..."):
-        out = compute_debt_eligibility(df, col_m1, col_m2, col_m3)
+if submitted:
+    if len({col_m1, col_m2, col_m3}) < 3:
+        st.warning("Please select 3 DIFFERENT balance columns.")
+        st.stop()
 
-        # Build result columns
+    with st.spinner("Computing eligibility..."):
+        # Project down to the mapped columns once; everything below works on this slice
         result_cols = [col_member]
         if col_member_name:
             result_cols.append(col_member_name)
-        result_cols += [col_route, col_m1, col_m2, col_m3, "DebtEligibility", "Reason"]
+        result_cols += [col_route, col_m1, col_m2, col_m3]
 
-        result_cols = [c for c in result_cols if c in out.columns]
-        results = out[result_cols].copy()
+        selected = df[result_cols]
+        results = pd.concat([selected, compute_debt_eligibility(selected, col_m1, col_m2, col_m3)], axis=1)
 
     st.subheader("Filter by Member No")
 
@@ -158,7 +302,7 @@ if st.button("Run eligibility"):
     selected_member = st.selectbox("Choose a Member No", ["(All)"] + member_values)
 
     if selected_member != "(All)":
-        filtered = results[results[col_member].astype(str) == selected_member].copy()
+        filtered = results[results[col_member].astype(str) == selected_member]
 
         # Show EXACT columns requested for filtered member
         show_cols = [col_member]
@@ -174,15 +318,23 @@ if st.button("Run eligibility"):
         st.dataframe(results, width="stretch")
 
     st.subheader("Summary")
-    summary = results["DebtEligibility"].value_counts(dropna=False).reset_index()
-    summary.columns = ["DebtEligibility", "Count"]
+    # Count straight off the categorical codes; unused categories are dropped
+    counts = np.bincount(results["DebtEligibility"].cat.codes.to_numpy(), minlength=len(ELIGIBILITY_CATEGORIES))
+    summary = pd.DataFrame({"DebtEligibility": ELIGIBILITY_CATEGORIES, "Count": counts})
+    summary = summary[summary["Count"] > 0].sort_values("Count", ascending=False, kind="stable").reset_index(drop=True)
     st.dataframe(summary, width="stretch")
 
-    towrite = io.BytesIO()
-    with pd.ExcelWriter(towrite, engine="openpyxl") as writer:
-        results.to_excel(writer, index=False, sheet_name="Results")
-        summary.to_excel(writer, index=False, sheet_name="Summary")
-    towrite.seek(0)
+    progress_bar = st.progress(0.0, text="Preparing Excel download...")
+    progress = {"fraction": 0.0}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(write_excel, results, summary, lambda f: progress.update(fraction=f))
+        while not future.done():
+            progress_bar.progress(progress["fraction"], text="Preparing Excel download...")
+            time.sleep(0.1)
+        towrite = future.result()
+
+    progress_bar.empty()
 
     st.download_button(
         "Download results (Excel)",